@@ -0,0 +1,106 @@
+/**
+ * H.264 (Annex B) camera feed decoder using WebCodecs
+ */
+
+// Baseline profile, level 3.1 (matches the server's NVENC settings)
+const H264_CODEC = 'avc1.42E01F';
+const NAL_TYPE_IDR = 5;
+const NAL_TYPE_AUD = 9;
+
+// Iterate NAL units as { start, type }, where start is the first payload byte
+function* nalUnits(bytes) {
+  for (let i = 0; i + 3 < bytes.length; i++) {
+    if (bytes[i] === 0 && bytes[i + 1] === 0 && bytes[i + 2] === 1) {
+      yield { start: i + 3, type: bytes[i + 3] & 0x1f };
+      i += 2;
+    }
+  }
+}
+
+// Split a payload into access units on AUD NAL units
+function splitAccessUnits(bytes) {
+  const units = [];
+  let unitStart = 0;
+  
+  for (const nal of nalUnits(bytes)) {
+    const startCode = nal.start - 3;
+    if (nal.type === NAL_TYPE_AUD && startCode > unitStart) {
+      units.push(bytes.subarray(unitStart, startCode));
+      unitStart = startCode;
+    }
+  }
+  
+  if (unitStart < bytes.length) {
+    units.push(bytes.subarray(unitStart));
+  }
+  return units;
+}
+
+function containsIdr(accessUnit) {
+  for (const nal of nalUnits(accessUnit)) {
+    if (nal.type === NAL_TYPE_IDR) return true;
+  }
+  return false;
+}
+
+export class H264Decoder {
+  constructor(onFrame) {
+    this.onFrame = onFrame; // Receives a VideoFrame; caller must close() it
+    this.decoder = null;
+    this.lastSeq = null;
+    this.waitingForKeyframe = true;
+    this.timestamp = 0;
+  }
+  
+  createDecoder() {
+    const decoder = new VideoDecoder({
+      output: (videoFrame) => this.onFrame(videoFrame),
+      error: (e) => {
+        console.error('H.264 decoder error:', e);
+        // Free the (possibly hardware) decoder now rather than at GC;
+        // a new one is created at the next keyframe
+        if (decoder.state !== 'closed') {
+          decoder.close();
+        }
+        if (this.decoder === decoder) {
+          this.decoder = null;
+          this.waitingForKeyframe = true;
+        }
+      }
+    });
+    
+    this.decoder = decoder;
+    this.decoder.configure({ codec: H264_CODEC, optimizeForLatency: true });
+  }
+  
+  decode(bytes, seq) {
+    // A sequence gap means a dropped frame - resync on the next IDR
+    if (this.lastSeq !== null && seq !== this.lastSeq + 1) {
+      this.waitingForKeyframe = true;
+    }
+    this.lastSeq = seq;
+    
+    for (const accessUnit of splitAccessUnits(bytes)) {
+      const isKey = containsIdr(accessUnit);
+      if (this.waitingForKeyframe && !isKey) continue;
+      
+      if (!this.decoder) {
+        this.createDecoder();
+      }
+      
+      this.waitingForKeyframe = false;
+      this.decoder.decode(new EncodedVideoChunk({
+        type: isKey ? 'key' : 'delta',
+        timestamp: this.timestamp++,
+        data: accessUnit
+      }));
+    }
+  }
+  
+  close() {
+    if (this.decoder && this.decoder.state !== 'closed') {
+      this.decoder.close();
+    }
+    this.decoder = null;
+  }
+}
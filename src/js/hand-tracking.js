@@ -45,12 +45,13 @@ export class HandTrackingManager {
   // Get hand center position in world coordinates
   getHandCenter(landmarks) {
     let minX = 1, maxX = 0, minY = 1, maxY = 0;
-    landmarks.forEach(lm => {
-      minX = Math.min(minX, lm.x);
-      maxX = Math.max(maxX, lm.x);
-      minY = Math.min(minY, lm.y);
-      maxY = Math.max(maxY, lm.y);
-    });
+    // Landmarks are a flat Float32Array of x, y, z triples
+    for (let i = 0; i < landmarks.length; i += 3) {
+      minX = Math.min(minX, landmarks[i]);
+      maxX = Math.max(maxX, landmarks[i]);
+      minY = Math.min(minY, landmarks[i + 1]);
+      maxY = Math.max(maxY, landmarks[i + 1]);
+    }
     
     const centerX = (minX + maxX) / 2;
     const centerY = (minY + maxY) / 2;
@@ -61,12 +62,13 @@ export class HandTrackingManager {
   // Calculate hand bounding box dimensions in world space
   getHandDimensions(landmarks) {
     let minX = 1, maxX = 0, minY = 1, maxY = 0;
-    landmarks.forEach(lm => {
-      minX = Math.min(minX, lm.x);
-      maxX = Math.max(maxX, lm.x);
-      minY = Math.min(minY, lm.y);
-      maxY = Math.max(maxY, lm.y);
-    });
+    // Landmarks are a flat Float32Array of x, y, z triples
+    for (let i = 0; i < landmarks.length; i += 3) {
+      minX = Math.min(minX, landmarks[i]);
+      maxX = Math.max(maxX, landmarks[i]);
+      minY = Math.min(minY, landmarks[i + 1]);
+      maxY = Math.max(maxY, landmarks[i + 1]);
+    }
     
     // Get dimensions in normalized camera space
     const normalizedWidth = maxX - minX;
@@ -97,11 +99,12 @@ export class HandTrackingManager {
   // Process hand tracking data
   processHandData(data) {
     // Handle new MediaPipe Tasks API structure: {right: {detected, landmarks}, left: {...}}
-    if (data.right?.detected && data.right?.landmarks?.length === 21) {
+    // where landmarks is a Float32Array of 21 x, y, z triples
+    if (data.right?.detected && data.right?.landmarks?.length === 63) {
       this.updateHand('right', data.right.landmarks);
     }
     
-    if (data.left?.detected && data.left?.landmarks?.length === 21) {
+    if (data.left?.detected && data.left?.landmarks?.length === 63) {
       this.updateHand('left', data.left.landmarks);
     }
   }
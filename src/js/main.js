@@ -25,6 +25,10 @@ class TellAVision {
     this.calibrationButtons = document.getElementById('calibrationButtons');
     this.useLastBtn = document.getElementById('useLast');
     this.calibrateNowBtn = document.getElementById('calibrateNow');
+    this.calibrationPreview = document.getElementById('calibrationPreview');
+    this.calibrationImage = document.getElementById('calibrationImage');
+    this.calibrationInfo = document.getElementById('calibrationInfo');
+    this.calibrationImageUrl = null;
   }
   
   async initialize() {
@@ -43,7 +47,7 @@ class TellAVision {
     
     // 3. Initialize WebSocket client with callbacks
     this.wsClient = new WebSocketClient(
-      (frameData) => this.onFrameData(frameData),
+      (frameBytes, frameMeta) => this.onFrameData(frameBytes, frameMeta),
       (handData) => this.onHandData(handData),
       (ballData) => this.onBallData(ballData)
     );
@@ -72,6 +76,10 @@ class TellAVision {
       this.onCalibrationComplete();
     };
     
+    this.wsClient.onCalibrationPreview = (jpegBytes, meta) => {
+      this.showCalibrationPreview(jpegBytes, meta);
+    };
+    
     // 7. Start Three.js animation loop
     this.threeScene.startAnimation();
     
@@ -89,6 +97,21 @@ class TellAVision {
     this.calibrateNowBtn.addEventListener('click', () => {
       this.handleCalibrationChoice(false);
     });
+    
+    // Clicks on the preview pick ball colours (normalized to the image)
+    this.calibrationImage.addEventListener('click', (event) => {
+      const rect = this.calibrationImage.getBoundingClientRect();
+      this.wsClient.sendCalibrationPick(
+        (event.clientX - rect.left) / rect.width,
+        (event.clientY - rect.top) / rect.height
+      );
+    });
+    
+    for (const command of ['auto', 'clear', 'done']) {
+      document.getElementById(`calibration-${command}`).addEventListener('click', () => {
+        this.wsClient.sendCalibrationCommand(command);
+      });
+    }
   }
   
   showCalibrationChoice() {
@@ -108,7 +131,7 @@ class TellAVision {
     if (useLast) {
       this.loadingStatus.textContent = 'Loading last settings...';
     } else {
-      this.loadingStatus.textContent = 'Starting calibration...\nFollow instructions in calibration window';
+      this.loadingStatus.textContent = 'Starting calibration...';
     }
     
     // Send choice to server
@@ -120,6 +143,23 @@ class TellAVision {
     }, 500);
   }
   
+  // Show a calibration preview frame (in-range pixels bright, the rest dimmed)
+  showCalibrationPreview(jpegBytes, meta) {
+    if (this.calibrationImageUrl) {
+      URL.revokeObjectURL(this.calibrationImageUrl);
+    }
+    this.calibrationImageUrl = URL.createObjectURL(new Blob([jpegBytes], { type: 'image/jpeg' }));
+    this.calibrationImage.src = this.calibrationImageUrl;
+    
+    const r = meta.range;
+    this.loadingStatus.textContent =
+      'Click the ball several times, then Auto Range; Done when the ball is bright';
+    this.calibrationInfo.textContent =
+      `Ball ${meta.ball + 1}/${meta.num_balls} - Picks: ${meta.picks} | ` +
+      `H(${r.h_min}-${r.h_max}) S(${r.s_min}-${r.s_max}) V(${r.v_min}-${r.v_max})`;
+    this.calibrationPreview.classList.add('show');
+  }
+  
   onConnectionChange(connected, message) {
     if (connected) {
       this.loadingStatus.textContent = 'Connected to server...';
@@ -137,6 +177,12 @@ class TellAVision {
     console.log('Calibration complete - hiding loading screen');
     this.loadingStatus.textContent = 'Starting...';
     
+    this.calibrationPreview.classList.remove('show');
+    if (this.calibrationImageUrl) {
+      URL.revokeObjectURL(this.calibrationImageUrl);
+      this.calibrationImageUrl = null;
+    }
+    
     // Hide loading screen and start app
     setTimeout(() => {
       this.uiController.onCalibrationComplete();
@@ -144,8 +190,8 @@ class TellAVision {
   }
   
   // Callback: Handle frame data from WebSocket
-  onFrameData(frameData) {
-    this.threeScene.updateCameraFrame(frameData);
+  onFrameData(frameBytes, frameMeta) {
+    this.threeScene.updateCameraFrame(frameBytes, frameMeta.codec, frameMeta.seq);
   }
   
   // Callback: Handle hand tracking data
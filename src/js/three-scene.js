@@ -2,6 +2,7 @@
  * Three.js scene setup and management
  */
 import { CONFIG } from './config.js';
+import { H264Decoder } from './h264-decoder.js';
 
 export class ThreeSceneManager {
   constructor() {
@@ -12,6 +13,10 @@ export class ThreeSceneManager {
     this.cssRenderer = null;
     this.cameraFeedPlane = null;
     this.cameraTexture = null;
+    this.cameraImage = null; // JPEG frames; H.264 frames are drawn to videoCanvas
+    this.h264Decoder = null;
+    this.videoCanvas = null;
+    this.videoContext = null;
     this.animating = false;
   }
   
@@ -54,8 +59,8 @@ export class ThreeSceneManager {
   }
   
   setupCameraFeed() {
-    const img = document.createElement('img');
-    this.cameraTexture = new THREE.Texture(img);
+    this.cameraImage = document.createElement('img');
+    this.cameraTexture = new THREE.Texture(this.cameraImage);
     this.cameraTexture.minFilter = THREE.LinearFilter;
     this.cameraTexture.magFilter = THREE.LinearFilter;
     
@@ -82,9 +87,51 @@ export class ThreeSceneManager {
     this.threeScene.add(this.cameraFeedPlane);
   }
   
-  updateCameraFrame(base64Image) {
-    const img = this.cameraTexture.image;
-    img.src = 'data:image/jpeg;base64,' + base64Image;
+  updateCameraFrame(frameBytes, codec, seq) {
+    if (codec === 'h264') {
+      this.decodeH264Frame(frameBytes, seq);
+      return;
+    }
+    
+    // The server falls back to JPEG if its H.264 encoder fails mid-stream
+    if (this.h264Decoder) {
+      this.h264Decoder.close();
+      this.h264Decoder = null;
+    }
+    
+    const img = this.cameraImage;
+    const previousUrl = img.src;
+    img.src = URL.createObjectURL(new Blob([frameBytes], { type: 'image/jpeg' }));
+    if (previousUrl.startsWith('blob:')) {
+      URL.revokeObjectURL(previousUrl);
+    }
+    this.cameraTexture.image = img;
+    this.cameraTexture.needsUpdate = true;
+  }
+  
+  decodeH264Frame(frameBytes, seq) {
+    if (!this.videoCanvas) {
+      this.videoCanvas = document.createElement('canvas');
+      this.videoContext = this.videoCanvas.getContext('2d');
+    }
+    if (!this.h264Decoder) {
+      this.h264Decoder = new H264Decoder((videoFrame) => this.drawVideoFrame(videoFrame));
+    }
+    
+    this.h264Decoder.decode(frameBytes, seq);
+  }
+  
+  drawVideoFrame(videoFrame) {
+    if (this.videoCanvas.width !== videoFrame.displayWidth ||
+        this.videoCanvas.height !== videoFrame.displayHeight) {
+      this.videoCanvas.width = videoFrame.displayWidth;
+      this.videoCanvas.height = videoFrame.displayHeight;
+    }
+    
+    this.videoContext.drawImage(videoFrame, 0, 0);
+    videoFrame.close();
+    
+    this.cameraTexture.image = this.videoCanvas;
     this.cameraTexture.needsUpdate = true;
   }
   
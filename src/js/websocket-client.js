@@ -3,12 +3,16 @@
  */
 import { CONFIG } from './config.js';
 
+const LANDMARK_FLOATS = 21 * 3;
+
 export class WebSocketClient {
   constructor(onFrameData, onHandData, onBallData) {
     this.ws = null;
     this.reconnectAttempts = 0;
     this.isReady = false;
     this.pendingRequests = new Map();
+    this.textDecoder = new TextDecoder();
+    this.textEncoder = new TextEncoder();
     
     // Callbacks
     this.onFrameData = onFrameData;
@@ -17,6 +21,7 @@ export class WebSocketClient {
     this.onConnectionChange = null;
     this.onCalibrationRequest = null;
     this.onCalibrationComplete = null; // NEW: Called when calibration data received
+    this.onCalibrationPreview = null; // Called with (jpegBytes, meta) during calibration
     
     // Performance tracking
     this.frameCount = 0;
@@ -29,6 +34,7 @@ export class WebSocketClient {
     console.log('Connecting to WebSocket server...');
     
     this.ws = new WebSocket(CONFIG.WEBSOCKET_URL);
+    this.ws.binaryType = 'arraybuffer';
     
     this.ws.onopen = () => {
       console.log('WebSocket connected');
@@ -41,7 +47,11 @@ export class WebSocketClient {
     };
     
     this.ws.onmessage = (event) => {
-      this.handleMessage(event.data);
+      if (typeof event.data === 'string') {
+        this.handleMessage(event.data);
+      } else {
+        this.handleBinaryMessage(event.data);
+      }
     };
     
     this.ws.onerror = (error) => {
@@ -86,10 +96,6 @@ export class WebSocketClient {
           this.send({ type: 'start_stream' });
           break;
           
-        case 'frame':
-          this.handleFrame(data);
-          break;
-          
         case 'hand_data':
           if (this.onHandData) {
             this.onHandData(data.data);
@@ -115,10 +121,43 @@ export class WebSocketClient {
     }
   }
   
-  handleFrame(data) {
+  // Binary frame layout: [uint32 BE meta length | meta JSON (padded to 4 bytes) |
+  // float32 landmarks, 21x3 per detected hand (right, then left) | encoded frame]
+  handleBinaryMessage(buffer) {
+    try {
+      const metaLength = new DataView(buffer).getUint32(0);
+      const meta = JSON.parse(this.textDecoder.decode(new Uint8Array(buffer, 4, metaLength)));
+      let offset = 4 + metaLength;
+      
+      // Calibration previews use the same layout, without landmarks
+      if (meta.type === 'calibration_preview') {
+        if (this.onCalibrationPreview) {
+          this.onCalibrationPreview(new Uint8Array(buffer, offset), meta);
+        }
+        return;
+      }
+      
+      // Attach each detected hand's landmarks as a flat [x0, y0, z0, x1, ...] view
+      for (const side of ['right', 'left']) {
+        const hand = meta.hands?.[side];
+        if (hand?.detected) {
+          hand.landmarks = new Float32Array(buffer, offset, LANDMARK_FLOATS);
+          offset += LANDMARK_FLOATS * 4;
+        }
+      }
+      
+      const frameBytes = new Uint8Array(buffer, offset);
+      
+      this.handleFrame(meta, frameBytes);
+    } catch (e) {
+      console.error('Error parsing binary frame:', e);
+    }
+  }
+  
+  handleFrame(data, frameBytes) {
     // Update frame
     if (this.onFrameData) {
-      this.onFrameData(data.frame);
+      this.onFrameData(frameBytes, data);
     }
     
     // Update tracking data
@@ -170,7 +209,9 @@ export class WebSocketClient {
       return false;
     }
     
-    this.ws.send(JSON.stringify(data));
+    // Sent as a binary frame: the server parses the JSON bytes directly,
+    // skipping the text-frame UTF-8 validation pass
+    this.ws.send(this.textEncoder.encode(JSON.stringify(data)));
     return true;
   }
   
@@ -183,6 +224,16 @@ export class WebSocketClient {
     });
   }
   
+  // Calibration pick at (x, y), each 0-1 across the preview image
+  sendCalibrationPick(x, y) {
+    this.send({ type: 'calibration_pick', x, y });
+  }
+  
+  // Calibration command: 'auto', 'clear' or 'done'
+  sendCalibrationCommand(command) {
+    this.send({ type: 'calibration_command', command });
+  }
+  
   async requestVideoUrl(youtubeUrl) {
     return new Promise((resolve, reject) => {
       const requestId = Date.now();
@@ -1,9 +1,20 @@
 """
 Camera initialization and management
 """
+import sys
 import cv2
 from config import *
 
+def capture_backend():
+    """Native capture API for this platform (MJPG, no extra conversion layer)"""
+    if sys.platform == 'win32':
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith('linux'):
+        return cv2.CAP_V4L2  # mmap'd driver buffers
+    if sys.platform == 'darwin':
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_ANY
+
 class Camera:
     def __init__(self):
         self.camera = None
@@ -15,7 +26,7 @@ class Camera:
         """Initialize camera with configured settings"""
         print("Initializing Camera...")
         
-        self.camera = cv2.VideoCapture(CAMERA_INDEX, cv2.CAP_DSHOW)
+        self.camera = cv2.VideoCapture(CAMERA_INDEX, capture_backend())
         
         # Set camera properties
         self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M','J','P','G'))
@@ -43,6 +54,14 @@ class Camera:
         """Read frame from camera"""
         return self.camera.read()
     
+    def grab(self):
+        """Wait for the next frame without decoding it"""
+        return self.camera.grab()
+    
+    def retrieve(self, dst=None):
+        """Decode the most recently grabbed frame (into dst if it fits)"""
+        return self.camera.retrieve(dst)
+    
     def release(self):
         """Release camera resources"""
         if self.camera:
@@ -4,6 +4,7 @@ Configuration settings for Tell-A-Vision server
 
 # ===== GPU SETTINGS =====
 USE_NVENC = True  # Enable NVENC hardware encoding (if available)
+USE_CUDA_TRACKING = True  # Run ball color thresholding on GPU (needs CUDA-enabled OpenCV)
 
 # ===== CAMERA SETTINGS =====
 CAMERA_INDEX = 0  # Camera device index (0, 1, 2, etc.)
@@ -23,13 +24,23 @@ JPEG_QUALITY = 85
 TARGET_FPS = 60
 
 # ===== TRACKING SETTINGS =====
+# Hand and ball tracking run on a downscaled copy of each frame
+TRACKING_WIDTH = 256
+TRACKING_HEIGHT = 192
+
 # Hand Tracking
 HAND_TRACKING_ENABLED = True
-HAND_TRACKING_SKIP = 2  # Process every Nth frame (1 = every frame, 2 = every other frame)
+HAND_TRACKING_IDLE_SKIP = 6  # While no hand is visible, look for one every Nth frame
 MAX_NUM_HANDS = 2
 MIN_DETECTION_CONFIDENCE = 0.3
 MIN_TRACKING_CONFIDENCE = 0.3
 HAND_MODEL_COMPLEXITY = 0  # 0 = lite, 1 = full (lite is faster)
+# Hand landmarker bundle; point at a quantized .task export to trade accuracy for speed
+HAND_MODEL_PATH = "hand_landmarker.task"
+# "CPU" runs TFLite on XNNPACK (predictable latency); "GPU" needs a working
+# OpenGL ES context and silently falls back to CPU without one
+HAND_TRACKING_DELEGATE = "CPU"
+HAND_MODEL_URL = "https://storage.googleapis.com/mediapipe-models/hand_landmarker/hand_landmarker/float16/1/hand_landmarker.task"
 
 # Ball Tracking
 BALL_TRACKING_ENABLED = True
@@ -41,6 +52,13 @@ MIN_BALL_AREA = 50
 # ===== SERVER SETTINGS =====
 DEFAULT_PORT = 5000
 HOST = "127.0.0.1"
+VIDEO_URL_CACHE_TTL = 3600  # Seconds to reuse a resolved YouTube URL (they expire after ~6h)
+VIDEO_URL_CACHE_SIZE = 256  # Resolved YouTube URLs kept at most
 
 # ===== PERFORMANCE SETTINGS =====
-FRAME_BUFFER_SIZE = 30  # For FPS calculation
\ No newline at end of file
+FRAME_BUFFER_SIZE = 30  # For FPS calculation
+STATS_INTERVAL = 2.0  # Seconds between stream stats lines (0 disables them)
+ENCODE_QUEUE_SIZE = 2  # Tracked frames buffered ahead of the encoder
+PUBLISH_QUEUE_SIZE = 30  # Encoded frames waiting for the broadcaster (H.264 sends every one)
+SEND_QUEUE_SIZE = 2  # JPEG frames queued per client; older ones are dropped for slow clients
+H264_SEND_QUEUE_SIZE = 15  # H.264 frames queued per client before a slow one skips to the next keyframe
\ No newline at end of file
@@ -1,110 +1,271 @@
 """
-Frame processing thread - captures, tracks, and encodes frames
+Frame processing pipeline - captures, tracks, and encodes frames
 """
 import cv2
 import time
+import numpy as np
+import queue
+import asyncio
 import threading
 from collections import deque
+from functools import partial
 from config import *
-from jpeg_encoder import create_encoder
+from jpeg_encoder import JPEGEncoder, create_encoder
+
+class RunningMean:
+    """Mean of the last N samples, kept as a running sum (O(1) to add and read)"""
+    
+    def __init__(self, size):
+        # Fixed float64 ring; slots read as 0 until the window first fills
+        self.samples = np.zeros(size)
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+    
+    def add(self, value):
+        """Add a sample, replacing the oldest once the window is full"""
+        self.total += value - float(self.samples[self.index])
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+    
+    def mean(self):
+        """Mean of the samples in the window (0 when empty)"""
+        return self.total / self.count if self.count else 0
 
 class FrameProcessor:
-    def __init__(self, camera, hand_tracker, ball_tracker):
+    def __init__(self, camera, hand_tracker, ball_tracker, loop, nvenc=None):
         self.camera = camera
         self.hand_tracker = hand_tracker
         self.ball_tracker = ball_tracker
         
         # Initialize encoder
         camera_width, camera_height, camera_fps = camera.get_dimensions()
-        self.encoder = create_encoder(
+        self.tracking_size = (TRACKING_WIDTH, TRACKING_HEIGHT)
+        self.tracking_scale = camera_width / TRACKING_WIDTH if camera_width else 1.0
+        self._small = None  # Reused downscaled frame for the trackers
+        self._use_encoder(create_encoder(
             width=camera_width,
             height=camera_height,
-            fps=int(camera_fps)
-        )
+            fps=int(camera_fps),
+            nvenc=nvenc
+        ))
+        
+        # Frames are decoded straight into a ring of preallocated buffers.
+        # A buffer is in use from decode until its encode finishes: one in
+        # tracking, ENCODE_QUEUE_SIZE queued, one encoding and one being
+        # decoded. Capture only decodes when the tracking queue is empty, so
+        # the ring never laps a buffer that is still in flight
+        self.frame_buffers = [np.empty((camera_height, camera_width, 3), np.uint8)
+                              for _ in range(ENCODE_QUEUE_SIZE + 3)]
+        self.buffer_index = 0
         
         # State
-        self.latest_frame = None
-        self.latest_encoded_frame = None
+        self.frame_seq = 0
         self.latest_hand_data = self.hand_tracker._empty_hand_data()
         self.latest_ball_data = {'balls': []}
+        # (sequence number, encoded bytes, codec, keyframe flag, hand data,
+        # ball data) per encoded frame, oldest first, until the broadcaster
+        # takes them. Every frame is kept (H.264 frames depend on their
+        # predecessors); deque appends and pops are thread-safe, and only an
+        # overflow drops the oldest
+        self.published = deque(maxlen=PUBLISH_QUEUE_SIZE)
+        
+        # Set on the server's event loop whenever a new frame is published
+        self.loop = loop
+        self.frame_ready = asyncio.Event()
         
         # Performance tracking
-        self.frame_times = deque(maxlen=FRAME_BUFFER_SIZE)
-        self.encode_times = deque(maxlen=FRAME_BUFFER_SIZE)
+        self.frame_times = RunningMean(FRAME_BUFFER_SIZE)
+        self.encode_times = RunningMean(FRAME_BUFFER_SIZE)
         self.last_frame_time = time.time()
         self.frame_counter = 0
         
+        # Pipeline: capture -> tracking -> encode, one thread per stage, so
+        # throughput is bound by the slowest stage, not the sum.
+        # Capture never waits: the single-slot tracking queue keeps only the
+        # newest frame. Tracking blocks on a full encode queue instead, so
+        # every tracked frame is encoded and memory stays bounded.
+        self.tracking_queue = queue.Queue(maxsize=1)
+        self.encode_queue = queue.Queue(maxsize=ENCODE_QUEUE_SIZE)
+        
         # Thread control
         self.running = False
-        self.thread = None
+        self.threads = []
     
     def start(self):
-        """Start frame processing thread"""
+        """Start capture, tracking and encode threads"""
         self.running = True
-        self.thread = threading.Thread(target=self._process_loop, daemon=True)
-        self.thread.start()
+        self.threads = [
+            threading.Thread(target=self._capture_loop, daemon=True),
+            threading.Thread(target=self._tracking_loop, daemon=True),
+            threading.Thread(target=self._encode_loop, daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
         print("Frame processor started")
     
     def stop(self):
-        """Stop frame processing thread"""
+        """Stop frame processing threads"""
         self.running = False
-        if self.thread:
-            self.thread.join(timeout=1.0)
+        for thread in self.threads:
+            thread.join(timeout=1.0)
         if self.encoder:
             self.encoder.release()
     
-    def _process_loop(self):
-        """Main processing loop"""
+    @staticmethod
+    def _put_latest(stage_queue, item):
+        """Put item on a single-slot queue, replacing any unconsumed item"""
+        try:
+            stage_queue.put_nowait(item)
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+            except queue.Empty:
+                pass
+            stage_queue.put_nowait(item)
+    
+    def _put_blocking(self, stage_queue, item):
+        """Put item on a queue, waiting for space (gives up once stopped)"""
         while self.running:
-            ret, frame = self.camera.read()
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+    
+    def _capture_loop(self):
+        """Stage A: read frames from the camera"""
+        while self.running:
+            # grab() blocks until the driver delivers the next frame
+            # (CAP_PROP_BUFFERSIZE=1), so it paces this loop by itself
+            if not self.camera.grab():
+                time.sleep(0.01)
+                continue
+            
+            # Decode on demand: while tracking still holds the previous
+            # frame this one would be dropped anyway, so skip its decode
+            if self.tracking_queue.full():
+                continue
+            
+            ret, frame = self.camera.retrieve(self.frame_buffers[self.buffer_index])
             if not ret:
-                time.sleep(0.001)
+                continue
+            self.buffer_index = (self.buffer_index + 1) % len(self.frame_buffers)
+            
+            self._put_latest(self.tracking_queue, frame)
+    
+    def _tracking_loop(self):
+        """Stage B: hand and ball tracking"""
+        while self.running:
+            try:
+                frame = self.tracking_queue.get(timeout=0.1)
+            except queue.Empty:
                 continue
             
-            self.latest_frame = frame
             self.frame_counter += 1
             
-            # Hand tracking (skip frames for performance)
-            if HAND_TRACKING_ENABLED and self.frame_counter % HAND_TRACKING_SKIP == 0:
-                self.latest_hand_data = self.hand_tracker.process(frame)
+            # Trackers work on a small copy; the full frame is only encoded.
+            # Both trackers finish with it before the next frame, so a single
+            # buffer is resized into every time
+            if self._small is None:
+                self._small = np.empty((TRACKING_HEIGHT, TRACKING_WIDTH, 3), frame.dtype)
+            small = cv2.resize(frame, self.tracking_size, dst=self._small,
+                               interpolation=cv2.INTER_AREA)
+            
+            # Hand tracking: every frame while a hand is visible (MediaPipe
+            # tracks from the previous landmarks), otherwise poll for new hands
+            hand_present = (self.latest_hand_data['right']['detected'] or
+                            self.latest_hand_data['left']['detected'])
+            if HAND_TRACKING_ENABLED and (hand_present or
+                                          self.frame_counter % HAND_TRACKING_IDLE_SKIP == 0):
+                self.latest_hand_data = self.hand_tracker.process(small)
             
             # Ball tracking (every 3rd frame)
             if BALL_TRACKING_ENABLED and self.frame_counter % 3 == 0:
-                balls = self.ball_tracker.detect(frame)
+                balls = self.ball_tracker.detect(small, scale=self.tracking_scale)
                 self.latest_ball_data = {'balls': balls}
             
-            # Encode frame
+            # Tracking results travel with their frame so they are published
+            # together with its encoding
+            self._put_blocking(self.encode_queue,
+                               (frame, self.latest_hand_data, self.latest_ball_data))
+    
+    def _encode_loop(self):
+        """Stage C: encode frames and publish them"""
+        while self.running:
+            try:
+                frame, hands, balls = self.encode_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            
+            # Submit frame; JPEG publishes before returning, NVENC from its
+            # reader thread once the access unit is out (time = submit cost)
             encode_start = time.time()
-            encoded = self._encode_frame(frame)
+            if not self.encoder.submit(frame, (hands, balls), JPEG_QUALITY):
+                self._fall_back_to_jpeg()
+                self.encoder.submit(frame, (hands, balls), JPEG_QUALITY)
             encode_time = (time.time() - encode_start) * 1000
-            self.encode_times.append(encode_time)
-            
-            self.latest_encoded_frame = encoded
+            self.encode_times.add(encode_time)
             
             # FPS calculation
             current_time = time.time()
-            self.frame_times.append(current_time - self.last_frame_time)
+            self.frame_times.add(current_time - self.last_frame_time)
             self.last_frame_time = current_time
-            
-            time.sleep(0.001)
     
-    def _encode_frame(self, frame):
-        """Encode frame using NVENC or JPEG"""
-        return self.encoder.encode(frame, JPEG_QUALITY)
+    def _fall_back_to_jpeg(self):
+        """Replace a failed (already released) encoder with CPU JPEG"""
+        print("[ENCODER] Encoder failed - switching to CPU JPEG")
+        encoder = self.encoder
+        self._use_encoder(JPEGEncoder(encoder.width, encoder.height, encoder.fps))
     
-    def get_latest_frame_data(self):
-        """Get latest frame and tracking data"""
-        return {
-            'encoded_frame': self.latest_encoded_frame,
-            'hands': self.latest_hand_data,
-            'balls': self.latest_ball_data
-        }
+    def _use_encoder(self, encoder):
+        """Make encoder current; its packets are published as its own"""
+        # Bound per encoder: a failed NVENC's reader can still deliver
+        # packets after the swap, and they must keep their H.264 codec
+        encoder.on_packets = partial(self._publish, encoder)
+        self.encoder = encoder
+    
+    def _publish(self, encoder, packets):
+        """Publish frames encoder produced with the tracking results they were tagged with"""
+        for encoded, tag in packets:
+            if not encoded or tag is None:
+                continue
+            hands, balls = tag
+            
+            # Sequence number, payload and tracking are queued as one tuple;
+            # H.264 clients use the sequence to detect dropped frames. The
+            # codec travels with each frame, as the encoder can change
+            self.frame_seq += 1
+            self.published.append((self.frame_seq, encoded, encoder.codec,
+                                   encoder.is_keyframe(encoded), hands, balls))
+        
+        # One wakeup for the whole batch; the broadcaster drains every frame
+        self.loop.call_soon_threadsafe(self.frame_ready.set)
+    
+    def get_published_frames(self):
+        """Take the frames published since the last call, oldest first"""
+        frames = []
+        while self.published:
+            frames.append(self.published.popleft())
+        
+        # A JPEG frame stands alone, so only the newest is worth sending
+        last = len(frames) - 1
+        return [{
+            'encoded_frame': encoded,
+            'seq': seq,
+            'codec': codec,
+            'key': key,
+            'hands': hands,
+            'balls': balls
+        } for i, (seq, encoded, codec, key, hands, balls) in enumerate(frames)
+          if codec != 'jpeg' or i == last]
     
     def get_performance_stats(self):
         """Get performance statistics"""
-        avg_frame_time = sum(self.frame_times) / len(self.frame_times) if self.frame_times else 0
+        avg_frame_time = self.frame_times.mean()
         fps = 1.0 / avg_frame_time if avg_frame_time > 0 else 0
-        avg_encode = sum(self.encode_times) / len(self.encode_times) if self.encode_times else 0
+        avg_encode = self.encode_times.mean()
         
         hand_status = "Y" if (self.latest_hand_data.get('right', {}).get('detected', False) or 
                               self.latest_hand_data.get('left', {}).get('detected', False)) else "N"
@@ -2,16 +2,26 @@
 Hand tracking using MediaPipe Tasks API (v0.10.31+)
 """
 import cv2
+import time
+import numpy as np
 import mediapipe as mp
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 from config import *
 
+# Shared result for hands that aren't visible (the common case); consumers
+# only read hand data, so the same objects are returned every frame
+_NO_HAND = {'detected': False, 'position': {'x':0,'y':0,'z':0}, 'landmarks': None}
+_EMPTY_HAND_DATA = {'right': _NO_HAND, 'left': _NO_HAND}
+
 class HandTracker:
     def __init__(self):
         self.detector = None
         self.enabled = HAND_TRACKING_ENABLED
-        
+        self._rgb = None  # Reused BGR->RGB conversion buffer
+        self._latest = _EMPTY_HAND_DATA  # Newest result from the async callback
+        self._last_timestamp_ms = -1
+    
     def initialize(self):
         """Initialize MediaPipe hand landmarker with new Tasks API"""
         if not self.enabled:
@@ -24,22 +34,26 @@ class HandTracker:
         import os
         import urllib.request
         
-        model_path = "hand_landmarker.task"
+        model_path = HAND_MODEL_PATH
         if not os.path.exists(model_path):
             print("Downloading hand landmarker model...")
-            model_url = "https://storage.googleapis.com/mediapipe-models/hand_landmarker/hand_landmarker/float16/1/hand_landmarker.task"
-            urllib.request.urlretrieve(model_url, model_path)
+            urllib.request.urlretrieve(HAND_MODEL_URL, model_path)
             print("Model downloaded")
         
         # Create HandLandmarker options
+        delegate = (python.BaseOptions.Delegate.GPU if HAND_TRACKING_DELEGATE == "GPU"
+                    else python.BaseOptions.Delegate.CPU)
         base_options = python.BaseOptions(
             model_asset_path=model_path,
-            delegate=python.BaseOptions.Delegate.GPU  # Try GPU acceleration
+            delegate=delegate
         )
         
         options = vision.HandLandmarkerOptions(
             base_options=base_options,
-            running_mode=vision.RunningMode.VIDEO,  # Video mode for live camera
+            # Live stream mode runs inference on MediaPipe's own thread and
+            # reports through the callback, so tracking doesn't block on it
+            running_mode=vision.RunningMode.LIVE_STREAM,
+            result_callback=self._on_result,
             num_hands=MAX_NUM_HANDS,
             min_hand_detection_confidence=MIN_DETECTION_CONFIDENCE,
             min_hand_presence_confidence=MIN_TRACKING_CONFIDENCE,
@@ -49,67 +63,72 @@ class HandTracker:
         # Create the hand landmarker
         self.detector = vision.HandLandmarker.create_from_options(options)
         
-        print("MediaPipe ready (GPU acceleration enabled if available)")
+        print(f"MediaPipe ready: {model_path} ({HAND_TRACKING_DELEGATE} delegate)")
     
     def process(self, frame):
         """Process frame and return hand tracking data"""
         if not self.enabled or not self.detector:
             return self._empty_hand_data()
         
-        # Convert BGR to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Convert BGR to RGB into a buffer allocated once per frame size
+        if self._rgb is None or self._rgb.shape != frame.shape:
+            self._rgb = np.empty_like(frame)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb)
         
         # Create MediaPipe Image
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb)
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=self._rgb)
         
-        # Detect hands (timestamp in milliseconds)
-        import time
-        timestamp_ms = int(time.time() * 1000)
-        detection_result = self.detector.detect_for_video(mp_image, timestamp_ms)
+        # Timestamps (milliseconds) must strictly increase between calls
+        timestamp_ms = max(int(time.monotonic() * 1000), self._last_timestamp_ms + 1)
+        self._last_timestamp_ms = timestamp_ms
+        
+        # Queue the frame and return the newest finished result; MediaPipe
+        # drops frames that arrive while the graph is still busy
+        self.detector.detect_async(mp_image, timestamp_ms)
+        return self._latest
+    
+    def _on_result(self, detection_result, output_image, timestamp_ms):
+        """Store the result of an async detection (runs on MediaPipe's thread)"""
+        self._latest = self._parse_result(detection_result)
+    
+    def _parse_result(self, detection_result):
+        """Convert a HandLandmarkerResult into right/left hand data"""
+        if not detection_result.hand_landmarks:
+            return _EMPTY_HAND_DATA
         
         # Parse results
-        right = {'detected': False, 'position': {'x':0,'y':0,'z':0}, 'landmarks': []}
-        left = {'detected': False, 'position': {'x':0,'y':0,'z':0}, 'landmarks': []}
+        right = left = _NO_HAND
         
-        if detection_result.hand_landmarks:
-            for idx, hand_landmarks in enumerate(detection_result.hand_landmarks):
-                # Get handedness (left or right)
-                handedness = detection_result.handedness[idx][0]
-                is_right = handedness.category_name == "Right"
-                
-                # Convert landmarks to list format
-                landmarks = []
-                for landmark in hand_landmarks:
-                    landmarks.append({
-                        'x': landmark.x,
-                        'y': landmark.y,
-                        'z': landmark.z
-                    })
-                
-                # Calculate center position (average of all landmarks)
-                avg_x = sum(lm['x'] for lm in landmarks) / len(landmarks)
-                avg_y = sum(lm['y'] for lm in landmarks) / len(landmarks)
-                avg_z = sum(lm['z'] for lm in landmarks) / len(landmarks)
-                
-                hand_data = {
-                    'detected': True,
-                    'position': {'x': avg_x, 'y': avg_y, 'z': avg_z},
-                    'landmarks': landmarks
-                }
-                
-                if is_right:
-                    right = hand_data
-                else:
-                    left = hand_data
+        for idx, hand_landmarks in enumerate(detection_result.hand_landmarks):
+            # Get handedness (left or right)
+            handedness = detection_result.handedness[idx][0]
+            is_right = handedness.category_name == "Right"
+            
+            # Landmarks stay a (21, 3) little-endian float32 array; the
+            # stream sends its raw bytes instead of 21 JSON objects.
+            # fromiter fills it directly, without a list of tuples
+            coords = np.fromiter((v for lm in hand_landmarks for v in (lm.x, lm.y, lm.z)),
+                                 dtype='<f4', count=3 * len(hand_landmarks)).reshape(-1, 3)
+            
+            # Calculate center position (average of all landmarks)
+            avg_x, avg_y, avg_z = coords.mean(axis=0).tolist()
+            
+            hand_data = {
+                'detected': True,
+                'position': {'x': avg_x, 'y': avg_y, 'z': avg_z},
+                'landmarks': coords
+            }
+            
+            if is_right:
+                right = hand_data
+            else:
+                left = hand_data
         
         return {'right': right, 'left': left}
     
     def _empty_hand_data(self):
-        """Return empty hand data structure"""
-        return {
-            'right': {'detected': False, 'position': {'x':0,'y':0,'z':0}, 'landmarks': []},
-            'left': {'detected': False, 'position': {'x':0,'y':0,'z':0}, 'landmarks': []}
-        }
+        """Return empty hand data structure (shared - do not mutate)"""
+        return _EMPTY_HAND_DATA
     
     def release(self):
         """Release MediaPipe resources"""
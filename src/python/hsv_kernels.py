@@ -0,0 +1,68 @@
+"""
+Numba kernels for HSV thresholding (optional - callers fall back to OpenCV)
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# OpenCV's fixed-point 8-bit BGR->HSV division tables (color_hsv.simd.hpp),
+# so the fused kernel reproduces cv2.cvtColor(COLOR_BGR2HSV) exactly
+HSV_SHIFT = 12
+_SDIV_TABLE = np.array([0] + [round((255 << HSV_SHIFT) / i) for i in range(1, 256)], np.int32)
+_HDIV_TABLE = np.array([0] + [round((180 << HSV_SHIFT) / (6 * i)) for i in range(1, 256)], np.int32)
+
+if NUMBA_AVAILABLE:
+    # nogil: the tracking thread drops the GIL for the whole kernel, so the
+    # encode thread and the asyncio loop keep running alongside it
+    @njit(parallel=True, fastmath=True, cache=True, nogil=True)
+    def classify_bgr(bgr, mins, maxs, masks):
+        """
+        Convert BGR to HSV and threshold every ball in one pass over the frame
+        
+        The HSV image is never written out: each row is converted into small
+        per-row buffers that stay in L1 while every ball's bounds are tested.
+        Hue ranges must not wrap (h_min <= h_max); calibration clamps them to
+        0-179, so the test stays a branchless pair of compares per channel.
+        
+        Args:
+            bgr: (H, W, 3) uint8 BGR image
+            mins: (N, 3) uint8 lower HSV bounds per ball
+            maxs: (N, 3) uint8 upper HSV bounds per ball
+            masks: (N, H, W) uint8 output, 255 where the pixel is in range
+        """
+        rows, cols = bgr.shape[0], bgr.shape[1]
+        half = 1 << (HSV_SHIFT - 1)
+        for y in prange(rows):
+            row = bgr[y]
+            hue = np.empty(cols, np.int32)
+            sat = np.empty(cols, np.int32)
+            val = np.empty(cols, np.int32)
+            
+            # Branchless form of OpenCV's RGB2HSV_b so LLVM can vectorize it
+            for x in range(cols):
+                b = np.int32(row[x, 0])
+                g = np.int32(row[x, 1])
+                r = np.int32(row[x, 2])
+                v = max(b, g, r)
+                diff = v - min(b, g, r)
+                vr = -np.int32(v == r)
+                vg = -np.int32(v == g)
+                h = (vr & (g - b)) + (~vr & ((vg & (b - r + 2 * diff)) +
+                                             (~vg & (r - g + 4 * diff))))
+                h = (h * _HDIV_TABLE[diff] + half) >> HSV_SHIFT
+                hue[x] = h + ((h >> 31) & 180)
+                sat[x] = (diff * _SDIV_TABLE[v] + half) >> HSV_SHIFT
+                val[x] = v
+            
+            for i in range(mins.shape[0]):
+                h_min, s_min, v_min = np.int32(mins[i, 0]), np.int32(mins[i, 1]), np.int32(mins[i, 2])
+                h_max, s_max, v_max = np.int32(maxs[i, 0]), np.int32(maxs[i, 1]), np.int32(maxs[i, 2])
+                out = masks[i, y]
+                for x in range(cols):
+                    out[x] = ((hue[x] >= h_min) & (hue[x] <= h_max) &
+                              (sat[x] >= s_min) & (sat[x] <= s_max) &
+                              (val[x] >= v_min) & (val[x] <= v_max)) * 255
@@ -2,21 +2,82 @@
 CPU JPEG Encoder - Simple and fast CPU-based encoding
 """
 import cv2
+from config import *
+from nvenc_encoder import NVENCEncoder, nvenc_available
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    TURBOJPEG_AVAILABLE = True
+except ImportError:
+    TURBOJPEG_AVAILABLE = False
+
+# One libjpeg-turbo handle for the whole process: TurboJPEG() loads the
+# shared library and sets up handles, and encoders can be recreated (e.g. a
+# new session after calibration). False means loading already failed
+_turbo = None
+
+def get_turbojpeg():
+    """Shared TurboJPEG instance, or None if PyTurboJPEG/libturbojpeg is missing"""
+    global _turbo
+    if _turbo is None:
+        _turbo = False
+        if TURBOJPEG_AVAILABLE:
+            try:
+                _turbo = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                print(f"[ENCODER] libturbojpeg not loadable ({e}) - using OpenCV")
+    return _turbo or None
 
 class JPEGEncoder:
     """CPU JPEG encoder"""
     
+    codec = 'jpeg'
+    
     def __init__(self, width, height, fps=30):
         self.width = width
         self.height = height
         self.fps = fps
-        print(f"[ENCODER] CPU JPEG initialized: {width}x{height} @ {fps}fps")
+        self.on_packets = None  # Called with [(jpeg bytes, tag)] for each frame
+        
+        # libjpeg-turbo's SIMD encoder straight from BGR, without OpenCV's
+        # per-call buffer handling. The output buffer is per encoder, so
+        # encoders on different threads never share one
+        self.turbo = get_turbojpeg()
+        self._jpeg_buf = None  # Reused TurboJPEG output buffer
+        
+        backend = "TurboJPEG" if self.turbo else "OpenCV"
+        print(f"[ENCODER] CPU JPEG ({backend}) initialized: {width}x{height} @ {fps}fps")
     
     def encode(self, frame, jpeg_quality=85):
         """Encode frame using CPU JPEG"""
+        if self.turbo:
+            # Compress into a buffer sized for the worst case once, instead of
+            # libjpeg-turbo allocating (and freeing) ~1MB per frame. The
+            # result is copied out because the published frame must outlive
+            # the next encode. 4:2:0 matches what cv2.imencode produced
+            buf_size = self.turbo.buffer_size(frame, TJSAMP_420)
+            if self._jpeg_buf is None or len(self._jpeg_buf) < buf_size:
+                self._jpeg_buf = bytearray(buf_size)
+            result, size = self.turbo.encode(frame, quality=jpeg_quality,
+                                             pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420,
+                                             dst=self._jpeg_buf)
+            return bytes(memoryview(result)[:size])
+        
         _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
         return buffer.tobytes()
     
+    def submit(self, frame, tag=None, jpeg_quality=85):
+        """Encode frame and hand the result straight to on_packets"""
+        encoded = self.encode(frame, jpeg_quality)
+        if self.on_packets:
+            self.on_packets([(encoded, tag)])
+        return True
+    
+    @staticmethod
+    def is_keyframe(packet):
+        """Every JPEG frame decodes on its own"""
+        return True
+    
     def is_using_gpu(self):
         """Check if GPU encoding is active (always False for CPU encoder)"""
         return False
@@ -25,16 +86,25 @@ class JPEGEncoder:
         """Release encoder resources"""
         pass
 
-def create_encoder(width, height, fps=30):
+def create_encoder(width, height, fps=30, nvenc=None):
     """
-    Create CPU JPEG encoder
+    Create NVENC H.264 encoder if enabled and available, else CPU JPEG
     
     Args:
         width: Frame width
         height: Frame height  
         fps: Target framerate
+        nvenc: Result of an earlier nvenc_available() probe; None probes
+            here, which blocks for up to 10s (keep it off the event loop)
         
     Returns:
-        JPEGEncoder instance
+        NVENCEncoder or JPEGEncoder instance
     """
+    if USE_NVENC:
+        if nvenc is None:
+            nvenc = nvenc_available()
+        if nvenc:
+            return NVENCEncoder(width, height, fps)
+        print("[ENCODER] NVENC not available - falling back to CPU JPEG")
+    
     return JPEGEncoder(width, height, fps)
\ No newline at end of file
@@ -12,6 +12,7 @@ from camera import Camera
 from hand_tracking import HandTracker
 from ball_tracking import BallTracker
 from frame_processor import FrameProcessor
+from nvenc_encoder import nvenc_available
 from video_service import VideoService
 from websocket_handler import WebSocketHandler
 
@@ -28,15 +29,33 @@ def print_config():
     print(f"   Camera Index: {CAMERA_INDEX}")
     print(f"   Resolution: {CAMERA_WIDTH}x{CAMERA_HEIGHT}")
     print(f"   Target FPS: {TARGET_FPS}")
+    print(f"   Tracking resolution: {TRACKING_WIDTH}x{TRACKING_HEIGHT}")
     print(f"   Hand Tracking: {'Enabled' if HAND_TRACKING_ENABLED else 'Disabled'}")
     if HAND_TRACKING_ENABLED:
-        print(f"     - Skip frames: {HAND_TRACKING_SKIP}")
+        print(f"     - Idle skip frames: {HAND_TRACKING_IDLE_SKIP}")
         print(f"     - Model complexity: {HAND_MODEL_COMPLEXITY}")
+        print(f"     - Delegate: {HAND_TRACKING_DELEGATE}")
     print(f"   Ball Tracking: {'Enabled' if BALL_TRACKING_ENABLED else 'Disabled'}")
     if BALL_TRACKING_ENABLED:
         print(f"     - Number of balls: {NUM_BALLS}")
     print()
 
+def run_event_loop(coro):
+    """Run coro on uvloop (POSIX) or winloop (Windows) if installed, else asyncio's loop"""
+    try:
+        if sys.platform == 'win32':
+            import winloop as fast_loop
+        else:
+            import uvloop as fast_loop
+    except ImportError:
+        print("Event loop: asyncio default (install uvloop/winloop for faster I/O)")
+        return asyncio.run(coro)
+    
+    # run() creates its own loop, like asyncio.run(); the global policy
+    # install() is deprecated
+    print(f"Event loop: {fast_loop.__name__}")
+    return fast_loop.run(coro)
+
 # Global objects
 calibration_ready_event = asyncio.Event()
 ball_tracker = None
@@ -89,6 +108,11 @@ async def main():
     
     print("[MAIN] Starting initialization...")
     
+    # The NVENC probe runs ffmpeg (up to 10s), so it runs in a worker
+    # thread alongside initialization and calibration
+    loop = asyncio.get_running_loop()
+    nvenc_probe = loop.run_in_executor(None, nvenc_available) if USE_NVENC else None
+    
     # Initialize system (camera, hand tracking)
     camera, camera_device, camera_dimensions, hand_tracker = await initialize_system()
     
@@ -109,10 +133,18 @@ async def main():
     port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
     print(f"[MAIN] Starting WebSocket server on port {port}...")
     
+    # Frames are already compressed (JPEG/H.264), so permessage-deflate
+    # would only burn CPU; keep the incoming queue and message size bounded.
+    # A 1 MiB write limit lets a full frame sit in the transport buffer
+    # without pausing the sender on every send.
     server = await websockets.serve(
         ws_handler.handle_client,
         HOST,
-        port
+        port,
+        compression=None,
+        max_queue=1,
+        max_size=2**23,
+        write_limit=2**20
     )
     
     print("=" * 70)
@@ -130,7 +162,9 @@ async def main():
     print("\n[MAIN] Starting frame processor...")
     
     # Now initialize frame processor with calibrated tracker
-    frame_processor = FrameProcessor(camera, hand_tracker, ball_tracker)
+    nvenc = await nvenc_probe if nvenc_probe else False
+    frame_processor = FrameProcessor(camera, hand_tracker, ball_tracker, loop,
+                                     nvenc=nvenc)
     frame_processor.start()
     print("[MAIN] Frame processor started")
     
@@ -158,6 +192,6 @@ async def main():
 
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        run_event_loop(main())
     except KeyboardInterrupt:
         print("\nGoodbye!")
\ No newline at end of file
@@ -0,0 +1,237 @@
+"""
+NVENC H.264 Encoder - hardware encoding through a persistent ffmpeg process
+"""
+import os
+import shutil
+import subprocess
+import threading
+from collections import deque
+import cv2
+import numpy as np
+
+# ffmpeg writes FLV, whose tags carry their own length, so each access unit
+# is known to be complete the moment its tag is read. Raw Annex B has no end
+# marker: an AU could only be split off when the next one's AUD arrived
+FLV_HEADER_SIZE = 9 + 4  # File header plus the first PreviousTagSize
+FLV_TAG_HEADER_SIZE = 11
+FLV_TAG_VIDEO = 9
+AVC_SEQUENCE_HEADER = 0  # AVCPacketType: SPS/PPS (AVCDecoderConfigurationRecord)
+AVC_NALU = 1  # AVCPacketType: one access unit of length-prefixed NAL units
+START_CODE = b'\x00\x00\x00\x01'
+NAL_TYPE_SLICE = 1
+NAL_TYPE_IDR = 5
+
+def nvenc_available():
+    """Check that ffmpeg is on PATH and can open an h264_nvenc session"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'color=black:s=256x256',
+             '-frames:v', '1', '-c:v', 'h264_nvenc', '-f', 'null', '-'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10
+        )
+    except (OSError, subprocess.SubprocessError):
+        return False
+    
+    return result.returncode == 0
+
+class NVENCEncoder:
+    """NVENC H.264 encoder (raw BGRX in, Annex-B access units out)"""
+    
+    codec = 'h264'
+    
+    def __init__(self, width, height, fps=30, preset='p1', tune='ull',
+                 bitrate=4_000_000, gop_seconds=2):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        
+        # h264_nvenc takes 32-bit RGB directly and converts to YUV on the
+        # GPU, so ffmpeg skips its CPU (swscale) BGR->YUV420 pass. Padding
+        # to BGRX is a plain widening copy into this reused buffer
+        self._bgrx = np.empty((height, width, 4), np.uint8)
+        self._bgrx_bytes = memoryview(self._bgrx).cast('B')
+        
+        # Fastest preset with ultra-low-latency tuning and no B-frames, so
+        # each frame's access unit comes out before the next one goes in.
+        # CBR with a one-frame VBV keeps frame sizes (and send times) even;
+        # a keyframe every gop_seconds lets new clients start decoding
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+             '-f', 'rawvideo', '-pix_fmt', 'bgr0',
+             '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+             '-c:v', 'h264_nvenc', '-preset', preset, '-tune', tune,
+             '-zerolatency', '1', '-delay', '0', '-bf', '0',
+             '-rc', 'cbr', '-b:v', str(bitrate), '-maxrate', str(bitrate),
+             '-bufsize', str(bitrate // fps),
+             '-g', str(fps * gop_seconds), '-profile:v', 'baseline',
+             '-flush_packets', '1', '-flvflags', 'no_duration_filesize',
+             '-f', 'flv', '-'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+        
+        # Completed access units are handed to on_packets([(packet, tag), ...])
+        # from the reader thread as soon as their FLV tag is read, each with
+        # the tag of the frame it encodes (one AU per frame: no B-frames).
+        # All AUs completed by one pipe read go out as one batch, in order
+        self.on_packets = None
+        self._tags = deque()
+        self._parameter_sets = b''  # Annex-B SPS/PPS, put in front of each IDR
+        self._length_size = 4  # Bytes in each AVCC NAL length prefix
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        
+        print(f"[ENCODER] NVENC H.264 initialized: {width}x{height} @ {fps}fps")
+    
+    def _read_loop(self):
+        """Turn ffmpeg's FLV tags into Annex-B access units as each one completes"""
+        buffer = bytearray()
+        # Pipe reads land in one reused chunk, and each access unit is
+        # copied out exactly once (a bytearray slice would copy twice)
+        chunk = bytearray(65536)
+        chunk_view = memoryview(chunk)
+        stdout = self.process.stdout
+        header = True
+        
+        while True:
+            n = stdout.readinto(chunk)
+            if not n:
+                break
+            buffer += chunk_view[:n]
+            
+            if header:
+                if len(buffer) < FLV_HEADER_SIZE:
+                    continue
+                del buffer[:FLV_HEADER_SIZE]
+                header = False
+            
+            # Tag header, data, then the 4-byte PreviousTagSize
+            packets = []
+            while len(buffer) >= FLV_TAG_HEADER_SIZE:
+                size = int.from_bytes(buffer[1:4], 'big')
+                end = FLV_TAG_HEADER_SIZE + size + 4
+                if len(buffer) < end:
+                    break
+                if buffer[0] & 0x1f == FLV_TAG_VIDEO and size > 5:
+                    with memoryview(buffer) as view:
+                        packet = self._video_tag(view[FLV_TAG_HEADER_SIZE:FLV_TAG_HEADER_SIZE + size])
+                    if packet:
+                        packets.append((packet, self._tags.popleft() if self._tags else None))
+                del buffer[:end]
+            
+            if packets and self.on_packets:
+                self.on_packets(packets)
+    
+    def _video_tag(self, data):
+        """Annex-B access unit from an FLV video tag's data (None for SPS/PPS)"""
+        # data[0] is frame type/codec id, data[1] the AVCPacketType and
+        # data[2:5] the composition time (always 0: no B-frames)
+        if data[1] == AVC_SEQUENCE_HEADER:
+            self._read_decoder_config(data[5:])
+            return None
+        if data[1] != AVC_NALU:
+            return None
+        
+        # Swap each NAL's length prefix for a start code. The client decodes
+        # from any IDR, so the parameter sets ride along with every one
+        parts = [self._parameter_sets] if data[0] >> 4 == 1 else []
+        n = self._length_size
+        pos = 5
+        while pos + n <= len(data):
+            length = int.from_bytes(data[pos:pos + n], 'big')
+            pos += n
+            parts.append(START_CODE)
+            parts.append(data[pos:pos + length])
+            pos += length
+        return b''.join(parts)
+    
+    def _read_decoder_config(self, record):
+        """Keep SPS/PPS (Annex B) and the NAL length size from an AVCDecoderConfigurationRecord"""
+        self._length_size = (record[4] & 0x03) + 1
+        parts = []
+        pos = 5
+        # SPS count sits in the low 5 bits, then the PPS count after the SPSs
+        for count_mask in (0x1f, 0xff):
+            count = record[pos] & count_mask
+            pos += 1
+            for _ in range(count):
+                length = int.from_bytes(record[pos:pos + 2], 'big')
+                pos += 2
+                parts.append(START_CODE)
+                parts.append(record[pos:pos + length])
+                pos += length
+        self._parameter_sets = b''.join(parts)
+    
+    @staticmethod
+    def is_keyframe(packet):
+        """True if the access unit holds an IDR slice (decodable on its own)"""
+        # Parameter sets and SEI come before the slices, so the first slice
+        # NAL decides it
+        start = packet.find(b'\x00\x00\x01')
+        while start != -1 and start + 3 < len(packet):
+            nal_type = packet[start + 3] & 0x1f
+            if nal_type in (NAL_TYPE_SLICE, NAL_TYPE_IDR):
+                return nal_type == NAL_TYPE_IDR
+            start = packet.find(b'\x00\x00\x01', start + 3)
+        return False
+    
+    def submit(self, frame, tag=None, jpeg_quality=85):
+        """
+        Queue frame for encoding without waiting for its output; the access
+        unit reaches on_packets once the reader thread has it
+        
+        Returns False once the ffmpeg process is gone (the encoder is then
+        released and the caller should switch encoders)
+        """
+        if self.process is None:
+            return False
+        
+        cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=self._bgrx)
+        self._tags.append(tag)
+        try:
+            # A pipe write can be short, and a partial frame would shift
+            # every later frame (and its tag), so write until it's all in
+            view = self._bgrx_bytes
+            fd = self.process.stdin.fileno()
+            while view:
+                view = view[os.write(fd, view):]
+        except (OSError, ValueError) as e:
+            # Broken pipe (ffmpeg exited) or stdin already closed
+            self._tags.pop()
+            print(f"[ENCODER] NVENC write failed ({e}) - disabling NVENC")
+            self.release()
+            return False
+        return True
+    
+    def is_using_gpu(self):
+        """Check if GPU encoding is active"""
+        return True
+    
+    def release(self):
+        """Stop and reap the ffmpeg process, freeing its NVENC session now"""
+        if self.process is None:
+            return
+        
+        # Closing stdin lets ffmpeg flush and exit; kill it if it doesn't.
+        # Either way wait() reaps it, so the GPU session is gone on return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2.0)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        
+        self._reader.join(timeout=1.0)
+        if not self._reader.is_alive():
+            self.process.stdout.close()
+        self.process = None
+        print("[ENCODER] NVENC session released")
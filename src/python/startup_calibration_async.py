@@ -5,10 +5,33 @@ Async Startup Calibration - Waits for WebSocket message instead of console input
 import cv2
 import numpy as np
 import json
+import math
 import os
-import time
 import asyncio
+from collections import deque
 from datetime import datetime
+from hsv_kernels import NUMBA_AVAILABLE
+if NUMBA_AVAILABLE:
+    from hsv_kernels import classify_bgr
+
+try:
+    import orjson
+    
+    def _dumps(obj):
+        """Serialize to JSON bytes; int ball ids become string keys"""
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        """Serialize to JSON bytes; int ball ids become string keys"""
+        return json.dumps(obj).encode('utf-8')
+    
+    _loads = json.loads
+
+# Consecutive failed camera reads before interactive calibration gives up
+CAMERA_READ_RETRIES = 5
+CAMERA_RETRY_DELAY = 0.2  # Seconds between those reads
 
 class AsyncCalibrator:
     def __init__(self, camera, num_balls=3):
@@ -16,21 +39,26 @@ class AsyncCalibrator:
         self.num_balls = num_balls
         self.choice_received = asyncio.Event()
         self.user_choice = None  # Will be set by WebSocket message
-        
-        # Read camera's actual current values
-        print("  Reading camera's actual settings...")
-        self.camera_settings = {
-            'brightness': int(self.camera.get(cv2.CAP_PROP_BRIGHTNESS)),
-            'contrast': int(self.camera.get(cv2.CAP_PROP_CONTRAST)),
-            'saturation': int(self.camera.get(cv2.CAP_PROP_SATURATION)),
-            'exposure': int(self.camera.get(cv2.CAP_PROP_EXPOSURE)),
-            'gain': int(self.camera.get(cv2.CAP_PROP_GAIN))
-        }
-        print(f"  Camera has: B={self.camera_settings['brightness']}, "
-              f"E={self.camera_settings['exposure']}, G={self.camera_settings['gain']}")
+        self.camera_settings = None  # From the last calibration, else the camera
         
         self.brightness_factor = 1.0
         
+        # Preview buffers: the structuring element is built once, and the
+        # mask (plus HSV image without Numba) on the first preview frame
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+        self._kernel_x2 = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))  # Two 5x5 dilations
+        self._hsv = None
+        self._mask = None  # (1, H, W) - classify_bgr's one-ball layout
+        self._mins = np.empty((1, 3), np.uint8)  # Current ball's bounds, updated
+        self._maxs = np.empty((1, 3), np.uint8)  # only when its range changes
+        self._preview = None  # Frame currently shown in the browser preview
+        self._shown = None  # Dimmed preview image that gets JPEG-encoded
+        # Picks/commands from the browser, oldest first. Accepted only while
+        # interactive calibration runs, and bounded either way (the preview
+        # loop drains it every frame)
+        self._inputs = deque(maxlen=64)
+        self.calibrating = False
+        
         # Default HSV presets
         presets = [
             {'h_min': 80, 'h_max': 100, 's_min': 80, 's_max': 255, 'v_min': 50, 'v_max': 255},
@@ -43,14 +71,32 @@ class AsyncCalibrator:
         
         # Try to load last calibration
         self.load_last()
+        
+        # Only ask the camera when nothing was saved: every get() is a driver
+        # round-trip (a COM call on DirectShow), and apply_cam reads back anyway
+        if self.camera_settings is None:
+            print("  Reading camera's actual settings...")
+            self.camera_settings = self._read_camera_settings()
+            print(f"  Camera has: B={self.camera_settings['brightness']}, "
+                  f"E={self.camera_settings['exposure']}, G={self.camera_settings['gain']}")
+    
+    def _read_camera_settings(self):
+        """Read the camera's current values for the calibrated properties"""
+        return {
+            'brightness': int(self.camera.get(cv2.CAP_PROP_BRIGHTNESS)),
+            'contrast': int(self.camera.get(cv2.CAP_PROP_CONTRAST)),
+            'saturation': int(self.camera.get(cv2.CAP_PROP_SATURATION)),
+            'exposure': int(self.camera.get(cv2.CAP_PROP_EXPOSURE)),
+            'gain': int(self.camera.get(cv2.CAP_PROP_GAIN))
+        }
     
     def load_last(self):
         """Load last calibration from JSON file"""
         calibration_file = os.path.join(os.path.dirname(__file__), 'last_calibration.json')
         if os.path.exists(calibration_file):
             try:
-                with open(calibration_file) as f:
-                    d = json.load(f)
+                with open(calibration_file, 'rb') as f:
+                    d = _loads(f.read())
                     self.camera_settings = d.get('camera_settings', self.camera_settings)
                     for k, v in d.get('hsv_ranges', {}).items():
                         self.hsv_ranges[int(k)] = v
@@ -61,24 +107,21 @@ class AsyncCalibrator:
     def save(self):
         """Save calibration to JSON file"""
         calibration_file = os.path.join(os.path.dirname(__file__), 'last_calibration.json')
-        with open(calibration_file, 'w') as f:
-            json.dump({
+        
+        # Write a temp file and rename it over the old one, so a crash
+        # mid-write can't leave a truncated calibration behind
+        tmp_file = calibration_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_dumps({
                 'camera_settings': self.camera_settings,
-                'hsv_ranges': {str(k): v for k, v in self.hsv_ranges.items()},
+                'hsv_ranges': self.hsv_ranges,
                 'timestamp': datetime.now().isoformat()
-            }, f)
+            }))
+        os.replace(tmp_file, calibration_file)
         print("  Saved calibration")
     
     def apply_cam(self):
         """Apply camera settings"""
-        try:
-            # Flush camera buffer
-            for _ in range(5):
-                self.camera.read()
-            time.sleep(0.3)
-        except:
-            pass
-        
         # Apply settings
         for k, v in [('BRIGHTNESS', 'brightness'), ('CONTRAST', 'contrast'), 
                      ('SATURATION', 'saturation'), ('AUTO_EXPOSURE', 1), 
@@ -88,14 +131,12 @@ class AsyncCalibrator:
                 v if isinstance(v, int) else self.camera_settings[v]
             )
         
-        time.sleep(0.3)
+        # Drop the frame queued under the old settings; grab() skips the
+        # decode that read() would do for a frame nobody looks at
+        self.camera.grab()
         
-        # Read back actual applied values
-        self.camera_settings['brightness'] = int(self.camera.get(cv2.CAP_PROP_BRIGHTNESS))
-        self.camera_settings['contrast'] = int(self.camera.get(cv2.CAP_PROP_CONTRAST))
-        self.camera_settings['saturation'] = int(self.camera.get(cv2.CAP_PROP_SATURATION))
-        self.camera_settings['exposure'] = int(self.camera.get(cv2.CAP_PROP_EXPOSURE))
-        self.camera_settings['gain'] = int(self.camera.get(cv2.CAP_PROP_GAIN))
+        # Read back actual applied values (drivers clamp out-of-range ones)
+        self.camera_settings.update(self._read_camera_settings())
     
     def set_choice(self, use_last):
         """Called by WebSocket handler when user makes choice"""
@@ -109,81 +150,159 @@ class AsyncCalibrator:
         await self.choice_received.wait()
         return self.user_choice
     
-    def calibrate_balls_interactive(self):
-        """Interactive ball calibration (opens CV window)"""
+    def _set_bounds(self, r):
+        """Copy HSV range r into the preview's threshold arrays"""
+        self._mins[0] = (r['h_min'], r['s_min'], r['v_min'])
+        self._maxs[0] = (r['h_max'], r['s_max'], r['v_max'])
+    
+    def _preview_mask(self, frame):
+        """Threshold frame with the current bounds, then open and close it (5x5) in place"""
+        if self._mask is None or self._mask.shape[1:] != frame.shape[:2]:
+            self._mask = np.empty((1,) + frame.shape[:2], np.uint8)
+        mins, maxs = self._mins, self._maxs
+        
+        if NUMBA_AVAILABLE:
+            # Fused BGR->HSV + threshold; the HSV image is never written out
+            classify_bgr(frame, mins, maxs, self._mask)
+            mask = self._mask[0]
+        else:
+            if self._hsv is None or self._hsv.shape != frame.shape:
+                self._hsv = np.empty_like(frame)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self._hsv)
+            mask = cv2.inRange(self._hsv, mins[0], maxs[0], dst=self._mask[0])
+        
+        # Open then close is erode, dilate, dilate, erode; the two middle
+        # dilations merge into one with the 9x9 square, saving a pass
+        cv2.erode(mask, self._kernel, dst=mask)
+        cv2.dilate(mask, self._kernel_x2, dst=mask)
+        cv2.erode(mask, self._kernel, dst=mask)
+        return mask
+    
+    def _preview_jpeg(self, frame, mask):
+        """Encode frame with pixels outside the mask dimmed, as shown in the browser"""
+        if self._shown is None or self._shown.shape != frame.shape:
+            self._shown = np.empty_like(frame)
+        np.right_shift(frame, 2, out=self._shown)
+        cv2.copyTo(frame, mask, self._shown)
+        _, jpeg = cv2.imencode('.jpg', self._shown, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        return jpeg.tobytes()
+    
+    def _handle_input(self, data, picks, r):
+        """Apply one pick/command from the browser; returns True when the ball is done"""
+        if not isinstance(data, dict):
+            return False
+        if data.get('type') == 'calibration_pick':
+            if self._preview is None:
+                return False
+            # Sample the frame that was clicked on (x/y are 0-1 across it),
+            # converting only that pixel
+            # Client input: NaN arrives as null, so anything that isn't a
+            # finite number is dropped rather than allowed to end calibration
+            try:
+                fx = float(data.get('x', 0))
+                fy = float(data.get('y', 0))
+            except (TypeError, ValueError):
+                return False
+            if not (math.isfinite(fx) and math.isfinite(fy)):
+                return False
+            height, width = self._preview.shape[:2]
+            x = min(max(int(fx * width), 0), width - 1)
+            y = min(max(int(fy * height), 0), height - 1)
+            h, s, v = cv2.cvtColor(self._preview[y:y + 1, x:x + 1], cv2.COLOR_BGR2HSV)[0, 0]
+            picks.append({'h': int(h), 's': int(s), 'v': int(v)})
+            print(f"      Picked: H={h} S={s} V={v}")
+            return False
+        
+        command = data.get('command')
+        if command == 'done' and len(picks) >= 2:
+            return True
+        elif command == 'auto' and len(picks) >= 2:  # Auto-detect
+            h_vals = [p['h'] for p in picks]
+            s_vals = [p['s'] for p in picks]
+            v_vals = [p['v'] for p in picks]
+            r.update({
+                'h_min': max(0, min(h_vals) - 10),
+                'h_max': min(179, max(h_vals) + 10),
+                's_min': max(0, min(s_vals) - 30),
+                's_max': min(255, max(s_vals) + 30),
+                'v_min': max(0, min(v_vals) - 40),
+                'v_max': min(255, max(v_vals) + 40)
+            })
+            self._set_bounds(r)
+            print(f"      Auto: H({r['h_min']}-{r['h_max']}) "
+                  f"S({r['s_min']}-{r['s_max']}) V({r['v_min']}-{r['v_max']})")
+        elif command == 'clear':
+            picks.clear()
+            print("      Cleared picks")
+        return False
+    
+    async def calibrate_balls_interactive(self):
+        """Interactive ball calibration, previewed and driven from the browser"""
         print("  Starting interactive calibration...")
-        print("  A calibration window will open - follow on-screen instructions")
+        print("  Follow the instructions in the browser")
+        
+        loop = asyncio.get_running_loop()
+        self.calibrating = True
+        # Ranges are edited in place; kept so a failed camera can restore them
+        previous = {bid: r.copy() for bid, r in self.hsv_ranges.items()}
         
-        cv2.namedWindow("Calibration")
+        try:
+            completed = await self._calibrate_balls(loop)
+        finally:
+            self.calibrating = False
+            self._inputs.clear()
+        
+        if not completed:
+            # Never persist half-finished ranges: they'd be loaded on every start
+            self.hsv_ranges = previous
+            print(f"  Camera read failed {CAMERA_READ_RETRIES} times in a row - "
+                  f"calibration aborted, not saved")
+            return False
         
+        self.save()
+        return True
+    
+    async def _calibrate_balls(self, loop):
+        """Run the pick/preview loop for every ball; False if the camera stops delivering"""
         for bid in range(self.num_balls):
             r = self.hsv_ranges[bid]
             picks = []
+            self._inputs.clear()
+            self._set_bounds(r)
             
             print(f"  Calibrating ball {bid}:")
-            print("    - Click on the ball in the video")
-            print("    - Click multiple times for better accuracy")
-            print("    - Press 'a' for auto-detect")
-            print("    - Press ENTER when done")
-            
-            def mouse_callback(event, x, y, flags, param):
-                if event == cv2.EVENT_LBUTTONDOWN:
-                    ret, frame = self.camera.read()
-                    if ret:
-                        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-                        h, s, v = hsv[y, x]
-                        picks.append({'h': int(h), 's': int(s), 'v': int(v)})
-                        print(f"      Picked: H={h} S={s} V={v}")
-            
-            cv2.setMouseCallback("Calibration", mouse_callback)
             
-            while True:
-                ret, frame = self.camera.read()
+            done = False
+            failures = 0
+            while not done:
+                # Blocking capture runs off the event loop, so picks and
+                # commands keep arriving while we wait for the camera
+                ret, frame = await loop.run_in_executor(None, self.camera.read)
                 if not ret:
-                    break
-                
-                hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-                
-                # Show instructions
-                cv2.putText(frame, f"Ball {bid} - Picks: {len(picks)}", 
-                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                cv2.putText(frame, "CLICK ball, 'a'=auto, ENTER=done", 
-                           (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
-                
-                # Show mask
-                mask = cv2.inRange(hsv, 
-                                  np.array([r['h_min'], r['s_min'], r['v_min']]),
-                                  np.array([r['h_max'], r['s_max'], r['v_max']]))
-                mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
-                mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+                    failures += 1
+                    if failures >= CAMERA_READ_RETRIES:
+                        return False
+                    await asyncio.sleep(CAMERA_RETRY_DELAY)
+                    continue
+                failures = 0
                 
-                cv2.imshow("Calibration", frame)
-                cv2.imshow("Mask", mask)
+                while self._inputs and not done:
+                    done = self._handle_input(self._inputs.popleft(), picks, r)
                 
-                key = cv2.waitKey(1) & 0xFF
-                
-                if key in [13, 10] and len(picks) >= 2:  # ENTER
-                    break
-                elif key == ord('a') and len(picks) >= 2:  # Auto-detect
-                    h_vals = [p['h'] for p in picks]
-                    s_vals = [p['s'] for p in picks]
-                    v_vals = [p['v'] for p in picks]
-                    r.update({
-                        'h_min': max(0, min(h_vals) - 10),
-                        'h_max': min(179, max(h_vals) + 10),
-                        's_min': max(0, min(s_vals) - 30),
-                        's_max': min(255, max(s_vals) + 30),
-                        'v_min': max(0, min(v_vals) - 40),
-                        'v_max': min(255, max(v_vals) + 40)
+                # Encoding a full-size JPEG would stall the loop (and every
+                # connected client) for milliseconds, so it runs off it too.
+                # The numba mask stays on this thread: a TBB threading layer
+                # first started from a worker thread hangs interpreter exit
+                mask = self._preview_mask(frame)
+                jpeg = await loop.run_in_executor(None, self._preview_jpeg, frame, mask)
+                self._preview = frame
+                if _preview_sink:
+                    _preview_sink(jpeg, {
+                        'ball': bid,
+                        'num_balls': self.num_balls,
+                        'picks': len(picks),
+                        'range': r
                     })
-                    print(f"      Auto: H({r['h_min']}-{r['h_max']}) "
-                          f"S({r['s_min']}-{r['s_max']}) V({r['v_min']}-{r['v_max']})")
-                elif key == ord('c'):  # Clear
-                    picks = []
-                    print("      Cleared picks")
-        
-        cv2.destroyAllWindows()
-        self.save()
         return True
     
     async def quick_calibrate(self):
@@ -202,7 +321,9 @@ class AsyncCalibrator:
         
         elif choice == 'calibrate':
             print("  Starting full calibration")
-            self.calibrate_balls_interactive()
+            if not await self.calibrate_balls_interactive():
+                print("  Falling back to last settings")
+                self.apply_cam()
             return True
         
         return False
@@ -217,6 +338,9 @@ class AsyncCalibrator:
 # Global calibrator instance
 _calibrator = None
 
+# Callback(jpeg_bytes, status) that shows calibration previews in the browser
+_preview_sink = None
+
 def create_calibrator(camera, num_balls=3):
     """Create calibrator instance"""
     global _calibrator
@@ -229,6 +353,16 @@ def set_calibration_choice(use_last):
     if _calibrator:
         _calibrator.set_choice(use_last)
 
+def set_preview_sink(callback):
+    """Register where calibration previews go (called by WebSocket handler)"""
+    global _preview_sink
+    _preview_sink = callback
+
+def add_calibration_input(data):
+    """Queue a calibration_pick/calibration_command message (called by WebSocket handler)"""
+    if _calibrator and _calibrator.calibrating:
+        _calibrator._inputs.append(data)
+
 async def run_async_calibration(camera, num_balls=3):
     """Run async calibration"""
     calibrator = create_calibrator(camera, num_balls)
@@ -3,76 +3,95 @@ Video URL service - fetches YouTube video URLs using yt-dlp
 Runs in thread pool to avoid blocking the event loop
 """
 import yt_dlp
+import time
 import asyncio
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from config import *
 
 class VideoService:
     def __init__(self):
         self.ydl_opts = {
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+            # Progressive MP4 (video + audio) over plain HTTP(S), then
+            # video-only MP4, then whatever yt-dlp ranks best; the chosen
+            # format's URL ends up in info['url']
+            'format': ('best[ext=mp4][vcodec!=none][acodec!=none][protocol^=http][protocol!*=dash]'
+                       '/bestvideo[ext=mp4][protocol^=http][protocol!*=dash]'
+                       '/best'),
+            'skip_download': True,
             'quiet': True,
             'no_warnings': True,
         }
         self.executor = ThreadPoolExecutor(max_workers=2)
+        self.url_cache = {}  # youtube_url -> (expires_at, result)
+        self._local = threading.local()  # One YoutubeDL per worker thread
+    
+    def _get_ydl(self):
+        """
+        YoutubeDL for the calling worker thread, created on first use
+        
+        Building one loads and registers every extractor, which costs far
+        more than a lookup; instances aren't thread-safe, so each executor
+        thread keeps its own
+        """
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = self._local.ydl = yt_dlp.YoutubeDL(self.ydl_opts)
+        return ydl
     
     def _fetch_video_url_sync(self, youtube_url):
         """
         Synchronous video URL fetch (runs in thread pool)
         """
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                info = ydl.extract_info(youtube_url, download=False)
-                
-                video_url = None
-                formats = info.get('formats', [])
-                
-                # Try to find progressive MP4 (video + audio)
-                for fmt in formats:
-                    if (fmt.get('ext') == 'mp4' and 
-                        fmt.get('vcodec') != 'none' and 
-                        fmt.get('acodec') != 'none' and
-                        fmt.get('protocol') in ['https', 'http']):
-                        video_url = fmt['url']
-                        break
-                
-                # Fallback: video-only MP4
-                if not video_url:
-                    for fmt in formats:
-                        if (fmt.get('ext') == 'mp4' and 
-                            fmt.get('vcodec') != 'none' and
-                            fmt.get('protocol') in ['https', 'http']):
-                            video_url = fmt['url']
-                            break
-                
-                # Last resort: any URL
-                if not video_url:
-                    video_url = info.get('url')
-                
-                if video_url:
-                    return {
-                        'success': True,
-                        'url': video_url,
-                        'title': info.get('title')
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'error': 'Could not find streamable format'
-                    }
-                    
+            info = self._get_ydl().extract_info(youtube_url, download=False)
+            video_url = info.get('url')
+            
+            if video_url:
+                return {
+                    'success': True,
+                    'url': video_url,
+                    'title': info.get('title')
+                }
+            else:
+                return {
+                    'success': False,
+                    'error': 'Could not find streamable format'
+                }
+        
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
     
+    def _cache_result(self, youtube_url, result):
+        """Cache a resolved URL, evicting expired and (past the cap) oldest entries"""
+        now = time.monotonic()
+        for url in [url for url, (expires_at, _) in self.url_cache.items() if expires_at <= now]:
+            del self.url_cache[url]
+        
+        # Re-inserting moves the URL to the end; with one TTL for every
+        # entry, insertion order is expiry order, so the first is the oldest
+        self.url_cache.pop(youtube_url, None)
+        while len(self.url_cache) >= VIDEO_URL_CACHE_SIZE:
+            del self.url_cache[next(iter(self.url_cache))]
+        self.url_cache[youtube_url] = (now + VIDEO_URL_CACHE_TTL, result)
+    
     async def get_video_url(self, youtube_url):
         """
         Async wrapper that runs yt-dlp in thread pool
         """
+        # Scenes reload the same clips; skip the multi-second extraction
+        # while the previously resolved URL is still valid
+        cached = self.url_cache.get(youtube_url)
+        if cached and cached[0] > time.monotonic():
+            print(f"[VIDEO] Cached: {cached[1].get('title')}")
+            return cached[1]
+        
         print(f"[VIDEO] Fetching URL for: {youtube_url}")
         
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         result = await loop.run_in_executor(
             self.executor,
             self._fetch_video_url_sync,
@@ -81,6 +100,7 @@ class VideoService:
         
         if result['success']:
             print(f"[VIDEO] Success: {result.get('title')}")
+            self._cache_result(youtube_url, result)
         else:
             print(f"[VIDEO] Failed: {result.get('error')}")
         
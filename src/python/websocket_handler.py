@@ -4,10 +4,45 @@ FIXED: Sends calibration data back to all clients after completion
 """
 import asyncio
 import json
-import base64
 import time
+import websockets
 from config import *
-from startup_calibration_async import set_calibration_choice
+from startup_calibration_async import (set_calibration_choice, set_preview_sink,
+                                       add_calibration_input)
+
+try:
+    import orjson
+    
+    def dumps_bytes(obj):
+        """Serialize to UTF-8 JSON bytes (orjson: C encoder, no str round-trip)"""
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    
+    def dumps(obj):
+        """Serialize to a JSON str, for text (control) messages"""
+        # Calibration ball ids are int keys; json.dumps stringified them too
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY |
+                            orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    # Parses str or bytes; orjson.JSONDecodeError subclasses json's
+    loads = orjson.loads
+except ImportError:
+    def dumps_bytes(obj):
+        """Serialize to UTF-8 JSON bytes"""
+        return json.dumps(obj).encode('utf-8')
+    
+    dumps = json.dumps
+    loads = json.loads
+
+def pack_message(meta, *payloads):
+    """
+    Build a binary message: [4-byte big-endian meta length | meta JSON | payloads]
+    
+    The meta JSON is padded with spaces to a multiple of 4 bytes so the
+    payloads start 4-byte aligned (the client views landmarks in place as
+    a Float32Array)
+    """
+    meta += b' ' * (-len(meta) % 4)
+    return b''.join((len(meta).to_bytes(4, 'big'), meta, *payloads))
 
 class WebSocketHandler:
     def __init__(self, frame_processor, video_service, camera_dimensions):
@@ -16,14 +51,41 @@ class WebSocketHandler:
         self.camera_dimensions = camera_dimensions
         self.camera_width, self.camera_height, _ = camera_dimensions
         self.connected_clients = set()
+        self.streaming_clients = {}  # Client -> its queue of outgoing frame messages
+        self.resyncing_clients = set()  # H.264 clients waiting for a keyframe
+        self.stream_tasks = {}  # Client -> its stream (writer) task
+        self.broadcast_task = None
+        self.stats_task = None
+        self.frames_sent = 0  # Frames handed to the client writers
+        self._frame_meta_prefixes = {}  # codec -> constant part of the frame meta
         self.calibration_settings = None
+        self.calibration_message = None  # Serialized once per calibration
+        self.calibration_done = asyncio.Event()  # Set with calibration_settings
         self.first_connection = True
         self.on_first_connection = None  # Callback to trigger calibration
         
+        # Calibration previews are shown in the browser, not a server window
+        set_preview_sink(self.broadcast_calibration_preview)
+        
+        # Inbound message type -> handler(websocket, data)
+        self.message_handlers = {
+            'calibration_choice': self._handle_calibration_choice,
+            'calibration_pick': self._handle_calibration_input,
+            'calibration_command': self._handle_calibration_input,
+            'start_stream': self._handle_start_stream,
+            'get_video_url': self._handle_video_url
+        }
+        
     def set_calibration_settings(self, settings):
         """Set calibration settings after initialization"""
         print("[HANDLER] Setting calibration settings")
         self.calibration_settings = settings
+        # Every current and future client gets the same text message
+        self.calibration_message = dumps({
+            'type': 'calibration',
+            'data': settings
+        })
+        self.calibration_done.set()
         
         # IMPORTANT: Send calibration data to all connected clients
         asyncio.create_task(self.broadcast_calibration())
@@ -36,24 +98,30 @@ class WebSocketHandler:
             print("[HANDLER] No calibration settings to broadcast!")
             return
         
-        message = json.dumps({
-            'type': 'calibration',
-            'data': self.calibration_settings
-        })
+        message = self.calibration_message
+        
+        # Send to all connected clients concurrently, so a slow client
+        # doesn't hold up the rest
+        clients = list(self.connected_clients)
+        results = await asyncio.gather(*(client.send(message) for client in clients),
+                                       return_exceptions=True)
         
-        # Send to all connected clients
         disconnected = set()
-        for client in self.connected_clients:
-            try:
-                await client.send(message)
-                print(f"[HANDLER] Sent calibration to {client.remote_address}")
-            except Exception as e:
-                print(f"[HANDLER] Failed to send to client: {e}")
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception):
+                print(f"[HANDLER] Failed to send to client: {result}")
                 disconnected.add(client)
+            else:
+                print(f"[HANDLER] Sent calibration to {client.remote_address}")
         
         # Remove disconnected clients
         self.connected_clients -= disconnected
     
+    def broadcast_calibration_preview(self, jpeg, status):
+        """Send one calibration preview frame to all connected clients"""
+        meta = dumps_bytes({'type': 'calibration_preview', 'codec': 'jpeg', **status})
+        websockets.broadcast(self.connected_clients, pack_message(meta, jpeg))
+    
     async def handle_client(self, websocket, path):
         """Handle individual WebSocket client connection"""
         self.connected_clients.add(websocket)
@@ -65,7 +133,7 @@ class WebSocketHandler:
             print("First client connected - requesting calibration choice...")
             
             # Send calibration request
-            await websocket.send(json.dumps({
+            await websocket.send(dumps({
                 'type': 'calibration_request'
             }))
             
@@ -77,30 +145,19 @@ class WebSocketHandler:
             # If calibration already done, send it immediately
             if self.calibration_settings is not None:
                 print(f"[HANDLER] Sending existing calibration to new client")
-                await websocket.send(json.dumps({
-                    'type': 'calibration',
-                    'data': self.calibration_settings
-                }))
+                await websocket.send(self.calibration_message)
             
-            # Create a task to handle streaming
-            stream_task = None
-            
-            # Handle incoming messages
+            # Handle incoming messages. The browser client sends its JSON as
+            # binary frames (no UTF-8 validation pass); loads takes bytes or str
             async for message in websocket:
-                data = json.loads(message)
+                data = loads(message)
                 msg_type = data.get('type')
                 
                 print(f"[HANDLER] Received message type: {msg_type}")
                 
-                if msg_type == 'calibration_choice':
-                    await self._handle_calibration_choice(websocket, data)
-                elif msg_type == 'start_stream':
-                    # Start streaming in background task
-                    if stream_task is None:
-                        stream_task = asyncio.create_task(self._handle_stream(websocket))
-                elif msg_type == 'get_video_url':
-                    print(f"[HANDLER] Handling video URL request for: {data.get('url')}")
-                    await self._handle_video_url(websocket, data)
+                handler = self.message_handlers.get(msg_type)
+                if handler:
+                    await handler(websocket, data)
                 else:
                     print(f"Unknown message type: {msg_type}")
                 
@@ -110,30 +167,13 @@ class WebSocketHandler:
             print(f"Client error: {e}")
         finally:
             self.connected_clients.discard(websocket)
+            self.streaming_clients.pop(websocket, None)
+            self.resyncing_clients.discard(websocket)
+            stream_task = self.stream_tasks.pop(websocket, None)
             if stream_task:
                 stream_task.cancel()
             print(f"Client disconnected from {websocket.remote_address}")
     
-    async def _handle_message(self, websocket, message):
-        """Route incoming message to appropriate handler"""
-        try:
-            data = json.loads(message)
-            msg_type = data.get('type')
-            
-            print(f"[HANDLER] Received message type: {msg_type}")
-            
-            if msg_type == 'calibration_choice':
-                await self._handle_calibration_choice(websocket, data)
-            elif msg_type == 'start_stream':
-                await self._handle_stream(websocket)
-            elif msg_type == 'get_video_url':
-                print(f"[HANDLER] Handling video URL request for: {data.get('url')}")
-                await self._handle_video_url(websocket, data)
-            else:
-                print(f"[failed]")
-        except:
-            pass
-    
     async def _handle_calibration_choice(self, websocket, data):
         """Handle calibration choice from client"""
         use_last = data.get('use_last', True)
@@ -145,81 +185,183 @@ class WebSocketHandler:
         # Calibration will complete in background
         # When done, set_calibration_settings() will be called which broadcasts to all clients
     
+    async def _handle_calibration_input(self, websocket, data):
+        """Pass a calibration pick or command on to the running calibration"""
+        add_calibration_input(data)
+    
+    async def _handle_start_stream(self, websocket, data):
+        """Start streaming to this client in a background task (once)"""
+        if websocket not in self.stream_tasks:
+            self.stream_tasks[websocket] = asyncio.create_task(self._handle_stream(websocket))
+    
     async def _handle_stream(self, websocket):
         """Handle video stream request"""
         print("[STREAM] Stream requested...")
         
-        # Wait for calibration if not done yet
-        timeout = 120  # 2 minutes timeout for calibration
-        start_time = time.time()
-        
-        while self.calibration_settings is None:
-            if time.time() - start_time > timeout:
-                print("[STREAM] Calibration timeout!")
-                await websocket.send(json.dumps({
-                    'type': 'error',
-                    'message': 'Calibration timeout - please refresh and try again'
-                }))
-                return
-            
-            await asyncio.sleep(0.1)
+        # Wait for calibration if not done yet (2 minute timeout)
+        try:
+            await asyncio.wait_for(self.calibration_done.wait(), timeout=120)
+        except asyncio.TimeoutError:
+            print("[STREAM] Calibration timeout!")
+            await websocket.send(dumps({
+                'type': 'error',
+                'message': 'Calibration timeout - please refresh and try again'
+            }))
+            return
         
         print("[STREAM] Starting stream...")
         
-        frame_count = 0
-        last_stats_time = time.time()
+        # Frames are built once by the broadcaster task and queued per client;
+        # this task is the connection's writer. The queue is short so a slow
+        # client drops stale frames instead of falling further behind
+        send_queue = asyncio.Queue()  # Bounded per codec by _queue_frame
+        self.streaming_clients[websocket] = send_queue
+        # H.264 decoding can only start at a keyframe
+        self.resyncing_clients.add(websocket)
+        if self.broadcast_task is None:
+            self.broadcast_task = asyncio.create_task(self._broadcast_frames())
+            if STATS_INTERVAL:
+                self.stats_task = asyncio.create_task(self._print_stats())
         
-        while websocket in self.connected_clients:
-            # Get latest frame data
-            if self.frame_processor is None:
-                await asyncio.sleep(0.1)
+        try:
+            while True:
+                await websocket.send(await send_queue.get())
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.streaming_clients.pop(websocket, None)
+            self.resyncing_clients.discard(websocket)
+    
+    async def _broadcast_frames(self):
+        """Build each frame message once and fan it out to every streaming client"""
+        # Streams only start once calibration is done, and the frame
+        # processor is attached before that. Bind what the per-frame path
+        # uses to locals once
+        frame_ready = self.frame_processor.frame_ready
+        get_published_frames = self.frame_processor.get_published_frames
+        streaming_clients = self.streaming_clients
+        frame_meta_for = self._frame_meta
+        pack_hands = self._pack_hands
+        queue_frame = self._queue_frame
+        
+        while True:
+            # Wake up when the encode thread publishes a frame; pacing follows
+            # the camera and TCP backpressure instead of a fixed sleep. One
+            # wakeup can cover several frames, and each goes out exactly once
+            # (H.264 frames depend on their predecessors, so none may be
+            # skipped or repeated)
+            await frame_ready.wait()
+            frame_ready.clear()
+            
+            frames = get_published_frames()
+            if not streaming_clients:
                 continue
-                
-            frame_data = self.frame_processor.get_latest_frame_data()
             
-            if frame_data['encoded_frame'] is None:
-                await asyncio.sleep(0.01)
+            for frame_data in frames:
+                # One binary message per frame:
+                # [4-byte big-endian meta length | meta JSON |
+                #  float32 landmarks (21x3 per detected hand, right then left) |
+                #  encoded frame]
+                hands, landmark_bytes = pack_hands(frame_data['hands'])
+                frame_meta = frame_meta_for(frame_data['codec'], {
+                    'seq': frame_data['seq'],
+                    'key': frame_data['key'],
+                    'hands': hands,
+                    'balls': frame_data['balls'],
+                    'timestamp': time.time()
+                })
+                
+                # Queue the same bytes for each client's writer without
+                # awaiting, so one slow client can't stall the others
+                message = pack_message(frame_meta, landmark_bytes, frame_data['encoded_frame'])
+                for client, send_queue in streaming_clients.items():
+                    queue_frame(client, send_queue, message,
+                                frame_data['codec'], frame_data['key'])
+                self.frames_sent += 1
+    
+    async def _print_stats(self):
+        """Print pipeline and stream stats every STATS_INTERVAL seconds"""
+        # Intervals use the loop's monotonic clock; the frame loop only
+        # counts frames, so it carries no stats work of its own
+        loop = asyncio.get_running_loop()
+        last_stats_time = loop.time()
+        last_frames_sent = self.frames_sent
+        
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            if self.frame_processor is None:
                 continue
             
-            # Encode frame as base64
-            frame_b64 = base64.b64encode(frame_data['encoded_frame']).decode('utf-8')
+            now = loop.time()
+            stream_fps = (self.frames_sent - last_frames_sent) / (now - last_stats_time)
+            stats = self.frame_processor.get_performance_stats()
             
-            # Send combined data
-            combined_data = {
+            print(f"Camera: {stats['fps']:.1f} FPS | "
+                  f"Stream: {stream_fps:.1f} FPS | "
+                  f"Encode: {stats['encode_time']:.1f}ms | "
+                  f"Hands: {stats['hand_status']} | "
+                  f"Balls: {stats['ball_count']} | "
+                  f"Clients: {len(self.streaming_clients)}")
+            
+            last_stats_time = now
+            last_frames_sent = self.frames_sent
+    
+    def _queue_frame(self, client, send_queue, message, codec, key):
+        """Queue a frame message for one client, dropping what it can't keep up with"""
+        if codec == 'jpeg':
+            # JPEG frames stand alone, so a slow client just loses the oldest
+            if send_queue.qsize() >= SEND_QUEUE_SIZE:
+                send_queue.get_nowait()
+            send_queue.put_nowait(message)
+            return
+        
+        # A dropped H.264 delta breaks every frame after it, so a client that
+        # falls behind drops its whole backlog and resumes at the next
+        # keyframe, instead of being sent deltas it can't decode. The backlog
+        # is longer than JPEG's: one wakeup can queue a burst of frames
+        if send_queue.qsize() >= H264_SEND_QUEUE_SIZE:
+            while not send_queue.empty():
+                send_queue.get_nowait()
+            self.resyncing_clients.add(client)
+        if client in self.resyncing_clients:
+            if not key:
+                return
+            self.resyncing_clients.discard(client)
+        send_queue.put_nowait(message)
+    
+    def _frame_meta(self, codec, fields):
+        """Frame meta JSON: the cached constant fields followed by this frame's"""
+        prefix = self._frame_meta_prefixes.get(codec)
+        if prefix is None:
+            # Constant object without its closing brace, ready for more fields
+            prefix = dumps_bytes({
                 'type': 'frame',
-                'frame': frame_b64,
+                'codec': codec,
                 'width': self.camera_width,
-                'height': self.camera_height,
-                'hands': frame_data['hands'],
-                'balls': frame_data['balls'],
-                'timestamp': time.time()
-            }
-            
-            await websocket.send(json.dumps(combined_data))
-            frame_count += 1
-            
-            # Print stats every 2 seconds
-            if time.time() - last_stats_time > 2.0:
-                stats = self.frame_processor.get_performance_stats()
-                
-                print(f"Camera: {stats['fps']:.1f} FPS | "
-                      f"Stream: {frame_count/2:.1f} FPS | "
-                      f"Encode: {stats['encode_time']:.1f}ms | "
-                      f"Hands: {stats['hand_status']} | "
-                      f"Balls: {stats['ball_count']}")
-                
-                frame_count = 0
-                last_stats_time = time.time()
-            
-            # Control stream rate
-            await asyncio.sleep(1.0 / TARGET_FPS)
+                'height': self.camera_height
+            })[:-1] + b','
+            self._frame_meta_prefixes[codec] = prefix
+        return prefix + dumps_bytes(fields)[1:]
+    
+    @staticmethod
+    def _pack_hands(hand_data):
+        """Split hand data into JSON-able summaries and raw landmark bytes"""
+        hands = {}
+        landmark_bytes = b''
+        for side in ('right', 'left'):
+            hand = hand_data[side]
+            hands[side] = {'detected': hand['detected'], 'position': hand['position']}
+            if hand['detected']:
+                landmark_bytes += hand['landmarks'].tobytes()
+        return hands, landmark_bytes
     
     async def _handle_video_url(self, websocket, data):
         """Handle video URL fetch request"""
         youtube_url = data.get('url')
+        print(f"[HANDLER] Handling video URL request for: {youtube_url}")
         result = await self.video_service.get_video_url(youtube_url)
         
-        await websocket.send(json.dumps({
+        await websocket.send(dumps({
             'type': 'video_url',
             **result
         }))